@@ -1,34 +1,269 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile, Header
+from fastapi import FastAPI, APIRouter, HTTPException, File, UploadFile, Header, Depends, Request
+from fastapi.routing import APIRoute
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import Response, JSONResponse
+from fastapi.encoders import jsonable_encoder
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pymongo
+import pymongo.monitoring
+import asyncio
+import contextvars
+import functools
+import hashlib
+import heapq
+import hmac
+import io
+import json
+import logging
 import os
+import random
+import threading
+import time
 import uuid
 import base64
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
 
-# CORS configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# ==================== Query Profiling ====================
+
+# Shape log: every Mongo command is timed per normalized query shape
+PROFILE_QUERIES = os.environ.get('PROFILE_QUERIES', 'false').lower() == 'true'
+# Fraction of get_applications calls that additionally run explain for docs examined
+PROFILE_EXPLAIN_SAMPLE_RATE = float(os.environ.get('PROFILE_EXPLAIN_SAMPLE_RATE', '0.01'))
+SLOW_QUERY_TOP_N = int(os.environ.get('SLOW_QUERY_TOP_N', '20'))
+SLOW_QUERY_MAX_SHAPES = int(os.environ.get('SLOW_QUERY_MAX_SHAPES', '500'))
+# With PROFILE_REQUESTS set, admin requests carrying this header are run under
+# cProfile; otherwise the middleware is not installed at all
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', 'false').lower() == 'true'
+PROFILE_HEADER = "X-Profile"
+PROFILED_REQUESTS_KEPT = 20
+
+def query_shape(value):
+    """Reduce a query to its structure: keys and operators kept, literal values replaced by 1"""
+    if isinstance(value, dict):
+        return {key: query_shape(value[key]) for key in sorted(value)}
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        return [query_shape(item) for item in value]
+    return 1
+
+def command_shape(command_name, command):
+    if command_name == "find":
+        return {"filter": query_shape(command.get("filter", {})), "sort": query_shape(command.get("sort", {}))}
+    if command_name == "aggregate":
+        return {"pipeline": query_shape(command.get("pipeline", []))}
+    if command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or [{}]
+        return {"filter": query_shape(statements[0].get("q", {}))}
+    if command_name in ("count", "distinct"):
+        return {"filter": query_shape(command.get("query", {}))}
+    return None
+
+class SlowQueryLog:
+    """Bounded per-shape timing table; the shape with the least total time is evicted first when full"""
+
+    def __init__(self, max_shapes: int):
+        self.max_shapes = max_shapes
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, collection, operation, shape):
+        key = (collection, operation, repr(shape))
+        entry = self._entries.get(key)
+        if entry is None:
+            if len(self._entries) >= self.max_shapes:
+                # Same metric top() ranks by, so a frequent cheap shape outlives a one-off
+                cheapest = min(self._entries, key=lambda k: self._entries[k]["total_ms"])
+                del self._entries[cheapest]
+            entry = self._entries[key] = {
+                "collection": collection,
+                "operation": operation,
+                "shape": shape,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "docs_examined": None,
+                "keys_examined": None,
+            }
+        return entry
+
+    def record(self, collection, operation, shape, elapsed_ms: float):
+        with self._lock:
+            entry = self._entry(collection, operation, shape)
+            entry["count"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+
+    def record_explain(self, collection, operation, shape, docs_examined, keys_examined):
+        with self._lock:
+            entry = self._entry(collection, operation, shape)
+            entry["docs_examined"] = docs_examined
+            entry["keys_examined"] = keys_examined
+
+    def top(self, n: int):
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+        for entry in entries:
+            entry["avg_ms"] = entry["total_ms"] / entry["count"] if entry["count"] else 0.0
+        return sorted(entries, key=lambda entry: entry["total_ms"], reverse=True)[:n]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+slow_queries = SlowQueryLog(SLOW_QUERY_MAX_SHAPES)
+
+class SlowQueryListener(pymongo.monitoring.CommandListener):
+    """Command monitor feeding slow_queries; registered on the client when PROFILE_QUERIES is set"""
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        shape = command_shape(event.command_name, event.command)
+        if shape is not None:
+            self._pending[(event.connection_id, event.request_id)] = (event.command.get(event.command_name), shape)
+
+    def succeeded(self, event):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending:
+            collection, shape = pending
+            slow_queries.record(collection, event.command_name, shape, event.duration_micros / 1000)
+
+    def failed(self, event):
+        self._pending.pop((event.connection_id, event.request_id), None)
+
+def explain_find(collection, query, sort):
+    """Record documents/keys examined for a find shape using the explain command"""
+    command = {"find": collection.name, "filter": query, "sort": dict(sort)}
+    try:
+        plan = collection.database.command("explain", command, verbosity="executionStats")
+    except pymongo.errors.PyMongoError:
+        return
+    stats = plan.get("executionStats", {})
+    slow_queries.record_explain(
+        collection.name, "find", command_shape("find", command),
+        stats.get("totalDocsExamined"), stats.get("totalKeysExamined")
+    )
+
+# Holds the cProfile.Profile for the current request when PROFILE_HEADER was sent
+_request_profiler = contextvars.ContextVar("request_profiler", default=None)
+profiled_requests = deque(maxlen=PROFILED_REQUESTS_KEPT)
+# cProfile hooks are per thread and async endpoints share the event-loop thread,
+# so overlapping profiled requests would clobber each other's hook
+_profile_slot = threading.Lock()
+
+def _profiled(endpoint):
+    # Sync endpoints run in the threadpool, where a profiler enabled by the
+    # middleware would not see them, so the profiler is switched on around the
+    # endpoint call itself
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            profiler = _request_profiler.get()
+            if profiler is None:
+                return await endpoint(*args, **kwargs)
+            profiler.enable()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profiler.disable()
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            profiler = _request_profiler.get()
+            if profiler is None:
+                return endpoint(*args, **kwargs)
+            profiler.enable()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                profiler.disable()
+    return wrapper
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+async def profile_request_middleware(request: Request, call_next):
+    if request.headers.get(PROFILE_HEADER) != "1" or request.headers.get("authorization") != f"Bearer {ADMIN_PASSWORD}":
+        return await call_next(request)
+    if not _profile_slot.acquire(blocking=False):
+        # Another request is being profiled; serve this one unprofiled
+        response = await call_next(request)
+        response.headers["X-Profile-Skipped"] = "busy"
+        return response
+    
+    import cProfile
+    import pstats
+    
+    profiler = cProfile.Profile()
+    token = _request_profiler.set(profiler)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _request_profiler.reset(token)
+        _profile_slot.release()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    output = io.StringIO()
+    try:
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(30)
+    except TypeError:
+        # Nothing was recorded, e.g. the path matched no route
+        pass
+    profile_id = str(uuid.uuid4())
+    profiled_requests.append({
+        "id": profile_id,
+        "method": request.method,
+        "path": request.url.path,
+        "elapsed_ms": elapsed_ms,
+        "profiled_at": datetime.utcnow(),
+        "stats": output.getvalue(),
+    })
+    response.headers["X-Profile-Id"] = profile_id
+    return response
+
+router = APIRouter(route_class=ProfiledRoute)
 
 # MongoDB connection
 mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 db_name = os.environ.get('DB_NAME', 'jobapp0')
+mongo_timeout_ms = int(os.environ.get('MONGO_TIMEOUT_MS', '5000'))
+
+# Created on first use rather than at import, so importing the module never
+# touches the network and a Mongo outage cannot break startup
+_client = None
+_db = None
+
+def get_db():
+    global _client, _db
+    if _db is None:
+        event_listeners = [SlowQueryListener()] if PROFILE_QUERIES else []
+        _client = pymongo.MongoClient(
+            mongo_url, serverSelectionTimeoutMS=mongo_timeout_ms, event_listeners=event_listeners
+        )
+        _db = _client[db_name]
+    return _db
+
+def set_database(database):
+    """Use an existing database handle instead of connecting to MONGO_URL"""
+    global _client, _db
+    _client = None
+    _db = database
 
-client = pymongo.MongoClient(mongo_url)
-db = client[db_name]
-applications_collection = db.applications
-portfolio_collection = db.portfolio
-cv_files_collection = db.cv_files
+def close_db():
+    global _client, _db
+    # Only tear down a client we created; an injected database belongs to the caller
+    if _client is not None:
+        _client.close()
+        _client = None
+        _db = None
 
 # Pydantic models
 class JobApplication(BaseModel):
@@ -61,34 +296,146 @@ class JobApplicationUpdate(BaseModel):
     progress: Optional[str] = None
     notes: Optional[str] = None
 
-@app.get("/")
+# ==================== Tenants ====================
+
+# Every application belongs to one owner and every query is scoped to it.
+# Clients identify themselves with an admin-issued X-User-Token; requests
+# without one act as DEFAULT_OWNER so the single-user frontend keeps working.
+DEFAULT_OWNER = os.environ.get('DEFAULT_OWNER', 'default')
+USER_TOKEN_SECRET = os.environ.get('USER_TOKEN_SECRET')
+
+def sign_user_token(user_id: str) -> str:
+    secret = (USER_TOKEN_SECRET or ADMIN_PASSWORD).encode('utf-8')
+    signature = hmac.new(secret, user_id.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f"{user_id}.{signature}"
+
+def get_owner(x_user_token: Optional[str] = Header(None)) -> str:
+    if not x_user_token:
+        return DEFAULT_OWNER
+    user_id = x_user_token.rpartition(".")[0]
+    if not user_id or not hmac.compare_digest(x_user_token, sign_user_token(user_id)):
+        raise HTTPException(status_code=401, detail="Invalid user token")
+    return user_id
+
+# ==================== Idempotency ====================
+
+# Writes sent with an Idempotency-Key header are recorded with their response;
+# a retry with the same key is answered from that record instead of writing again
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_SECONDS', '86400'))
+# A claim with no response after this long belongs to a request that died; a retry may take it over
+IDEMPOTENCY_CLAIM_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_CLAIM_LEASE_SECONDS', '60'))
+
+def request_fingerprint(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else json.dumps(jsonable_encoder(part), sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def claim_idempotency_key(scope: str, key: str, fingerprint: str):
+    """Return the stored response for a repeated key, or None once this request owns the key"""
+    now = datetime.utcnow()
+    for _ in range(3):
+        existing = get_db().idempotency_keys.find_one({"scope": scope, "key": key}, {"_id": 0})
+        if existing is not None:
+            break
+        try:
+            get_db().idempotency_keys.insert_one({
+                "scope": scope,
+                "key": key,
+                "fingerprint": fingerprint,
+                "response": None,
+                "created_at": now,
+                "claimed_at": now
+            })
+            return None
+        except pymongo.errors.DuplicateKeyError:
+            # A concurrent request claimed it first; re-read, since that claim
+            # may already be gone again (released on failure or expired)
+            continue
+    else:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+    
+    if existing["fingerprint"] != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    if existing["response"] is not None:
+        return existing["response"]
+    
+    # Atomically take over an expired claim so only one retry re-runs the request
+    lease_cutoff = now - timedelta(seconds=IDEMPOTENCY_CLAIM_LEASE_SECONDS)
+    taken = get_db().idempotency_keys.find_one_and_update(
+        {
+            "scope": scope,
+            "key": key,
+            "response": None,
+            "$or": [{"claimed_at": {"$lt": lease_cutoff}}, {"claimed_at": {"$exists": False}}]
+        },
+        {"$set": {"claimed_at": now}}
+    )
+    if taken is None:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+    return None
+
+def complete_idempotency_key(scope: str, key: str, response):
+    get_db().idempotency_keys.update_one(
+        {"scope": scope, "key": key},
+        {"$set": {"response": jsonable_encoder(response)}}
+    )
+
+def release_idempotency_key(scope: str, key: str):
+    # The request failed before writing, so let a retry run it again
+    get_db().idempotency_keys.delete_one({"scope": scope, "key": key, "response": None})
+
+@router.get("/")
 def read_root():
     return {"message": "Job Application Tracker API"}
 
-@app.post("/api/applications", response_model=JobApplicationResponse)
-def create_application(application: JobApplication):
+@router.post("/api/applications", response_model=JobApplicationResponse)
+def create_application(
+    application: JobApplication,
+    owner_id: str = Depends(get_owner),
+    idempotency_key: Optional[str] = Header(None)
+):
+    if idempotency_key:
+        scope = f"create_application:{owner_id}"
+        stored = claim_idempotency_key(scope, idempotency_key, request_fingerprint(application))
+        if stored is not None:
+            return stored
+        try:
+            response = _insert_application(application, owner_id)
+        except Exception:
+            release_idempotency_key(scope, idempotency_key)
+            raise
+        complete_idempotency_key(scope, idempotency_key, response)
+        return response
+    
+    return _insert_application(application, owner_id)
+
+def _insert_application(application: JobApplication, owner_id: str) -> JobApplicationResponse:
     app_id = str(uuid.uuid4())
     now = datetime.utcnow()
     
     app_dict = application.dict()
     app_dict["id"] = app_id
+    app_dict["owner_id"] = owner_id
     app_dict["created_at"] = now
     app_dict["updated_at"] = now
     app_dict["application_date"] = application.application_date.isoformat()
     
-    applications_collection.insert_one(app_dict)
+    get_db().applications.insert_one(app_dict)
     
     return JobApplicationResponse(**app_dict)
 
-@app.get("/api/applications")
+@router.get("/api/applications")
 def get_applications(
     status: Optional[str] = None,
     search: Optional[str] = None,
     progress: Optional[str] = None,
     page: Optional[int] = 1,
-    limit: Optional[int] = 20
+    limit: Optional[int] = 20,
+    include_archived: bool = False,
+    owner_id: str = Depends(get_owner)
 ):
-    query = {}
+    query = {"owner_id": owner_id}
     
     if status:
         query["status"] = status
@@ -107,14 +454,27 @@ def get_applications(
     
     # Calculate pagination
     skip = (page - 1) * limit
-    total = applications_collection.count_documents(query)
+    total = get_db().applications.count_documents({**query, "deleted_at": None})
     
-    applications = list(
-        applications_collection.find(query, {"_id": 0})
-        .sort("created_at", -1)
-        .skip(skip)
-        .limit(limit)
-    )
+    if include_archived:
+        total += get_db().applications_archive.count_documents(query)
+        # Each collection contributes at most skip + limit rows; merge them by
+        # created_at and cut the requested page out of the combined stream
+        window = skip + limit
+        hot = get_db().applications.find({**query, "deleted_at": None}, {"_id": 0, "owner_id": 0}).sort("created_at", -1).limit(window)
+        archived = get_db().applications_archive.find(query, {"_id": 0, "owner_id": 0, "archived_at": 0}).sort("created_at", -1).limit(window)
+        merged = heapq.merge(hot, archived, key=lambda doc: doc["created_at"], reverse=True)
+        applications = list(merged)[skip:window]
+    else:
+        applications = list(
+            get_db().applications.find({**query, "deleted_at": None}, {"_id": 0, "owner_id": 0})
+            .sort("created_at", -1)
+            .skip(skip)
+            .limit(limit)
+        )
+    
+    if PROFILE_QUERIES and random.random() < PROFILE_EXPLAIN_SAMPLE_RATE:
+        explain_find(get_db().applications, {**query, "deleted_at": None}, [("created_at", -1)])
     
     for app in applications:
         if isinstance(app["application_date"], str):
@@ -128,9 +488,11 @@ def get_applications(
         "total_pages": (total + limit - 1) // limit
     }
 
-@app.get("/api/applications/{app_id}", response_model=JobApplicationResponse)
-def get_application(app_id: str):
-    application = applications_collection.find_one({"id": app_id}, {"_id": 0})
+@router.get("/api/applications/{app_id}", response_model=JobApplicationResponse)
+def get_application(app_id: str, include_archived: bool = False, owner_id: str = Depends(get_owner)):
+    application = get_db().applications.find_one({"id": app_id, "owner_id": owner_id, "deleted_at": None}, {"_id": 0})
+    if not application and include_archived:
+        application = get_db().applications_archive.find_one({"id": app_id, "owner_id": owner_id}, {"_id": 0})
     if not application:
         raise HTTPException(status_code=404, detail="Application not found")
     
@@ -139,9 +501,9 @@ def get_application(app_id: str):
     
     return JobApplicationResponse(**application)
 
-@app.put("/api/applications/{app_id}", response_model=JobApplicationResponse)
-def update_application(app_id: str, application_update: JobApplicationUpdate):
-    existing_app = applications_collection.find_one({"id": app_id}, {"_id": 0})
+@router.put("/api/applications/{app_id}", response_model=JobApplicationResponse)
+def update_application(app_id: str, application_update: JobApplicationUpdate, owner_id: str = Depends(get_owner)):
+    existing_app = get_db().applications.find_one({"id": app_id, "owner_id": owner_id, "deleted_at": None}, {"_id": 0})
     if not existing_app:
         raise HTTPException(status_code=404, detail="Application not found")
     
@@ -151,32 +513,68 @@ def update_application(app_id: str, application_update: JobApplicationUpdate):
     if "application_date" in update_data:
         update_data["application_date"] = update_data["application_date"].isoformat()
     
-    applications_collection.update_one({"id": app_id}, {"$set": update_data})
+    get_db().applications.update_one({"id": app_id, "owner_id": owner_id}, {"$set": update_data})
     
-    updated_app = applications_collection.find_one({"id": app_id}, {"_id": 0})
+    updated_app = get_db().applications.find_one({"id": app_id, "owner_id": owner_id}, {"_id": 0})
     if isinstance(updated_app["application_date"], str):
         updated_app["application_date"] = datetime.fromisoformat(updated_app["application_date"]).date()
     
     return JobApplicationResponse(**updated_app)
 
-@app.delete("/api/applications/{app_id}")
-def delete_application(app_id: str):
-    result = applications_collection.delete_one({"id": app_id})
-    if result.deleted_count == 0:
+@router.delete("/api/applications/{app_id}")
+def delete_application(app_id: str, owner_id: str = Depends(get_owner)):
+    # Soft delete: leave a tombstone that compaction purges after the retention window
+    now = datetime.utcnow()
+    result = get_db().applications.update_one(
+        {"id": app_id, "owner_id": owner_id, "deleted_at": None},
+        {"$set": {"deleted_at": now, "updated_at": now}}
+    )
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Application not found")
     return {"message": "Application deleted successfully"}
 
-@app.get("/api/applications/stats/summary")
-def get_application_stats():
+@router.post("/api/applications/{app_id}/restore", response_model=JobApplicationResponse)
+def restore_application(app_id: str, owner_id: str = Depends(get_owner)):
+    result = get_db().applications.update_one(
+        {"id": app_id, "owner_id": owner_id, "deleted_at": {"$ne": None}},
+        {"$unset": {"deleted_at": ""}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+    if result.matched_count == 0:
+        # Not a tombstone, so it may have been moved to the archive instead
+        archived_app = get_db().applications_archive.find_one({"id": app_id, "owner_id": owner_id}, {"_id": 0, "archived_at": 0})
+        if not archived_app:
+            raise HTTPException(status_code=404, detail="Deleted or archived application not found")
+        archived_app["updated_at"] = datetime.utcnow()
+        get_db().applications.replace_one({"id": app_id, "owner_id": owner_id}, archived_app, upsert=True)
+        get_db().applications_archive.delete_one({"id": app_id, "owner_id": owner_id})
+    
+    restored_app = get_db().applications.find_one({"id": app_id, "owner_id": owner_id}, {"_id": 0})
+    if isinstance(restored_app["application_date"], str):
+        restored_app["application_date"] = datetime.fromisoformat(restored_app["application_date"]).date()
+    
+    return JobApplicationResponse(**restored_app)
+
+@router.get("/api/applications/stats/summary")
+def get_application_stats(include_archived: bool = False, owner_id: str = Depends(get_owner)):
+    return compute_application_stats(owner_id, include_archived)
+
+def compute_application_stats(owner_id: str, include_archived: bool = False):
     pipeline = [
+        {"$match": {"owner_id": owner_id, "deleted_at": None}},
         {"$group": {
             "_id": "$status",
             "count": {"$sum": 1}
         }}
     ]
     
-    stats = list(applications_collection.aggregate(pipeline))
-    stats_dict = {item["_id"]: item["count"] for item in stats}
+    stats = list(get_db().applications.aggregate(pipeline))
+    if include_archived:
+        archive_pipeline = [{"$match": {"owner_id": owner_id}}] + pipeline[1:]
+        stats += list(get_db().applications_archive.aggregate(archive_pipeline))
+    
+    stats_dict = {}
+    for item in stats:
+        stats_dict[item["_id"]] = stats_dict.get(item["_id"], 0) + item["count"]
     
     total = sum(stats_dict.values())
     
@@ -221,10 +619,10 @@ def verify_admin(authorization: Optional[str] = Header(None)):
         raise HTTPException(status_code=401, detail="Unauthorized")
     return True
 
-@app.get("/api/portfolio")
+@router.get("/api/portfolio")
 def get_portfolio():
     """Get portfolio data (public endpoint)"""
-    portfolio = portfolio_collection.find_one({"type": "main"}, {"_id": 0})
+    portfolio = get_db().portfolio.find_one({"type": "main"}, {"_id": 0})
     
     if not portfolio:
         # Initialize with default data from sample
@@ -263,7 +661,7 @@ def get_portfolio():
             "github": "",
             "location": ""
         }
-        portfolio_collection.insert_one(default_portfolio.copy())
+        get_db().portfolio.insert_one(default_portfolio.copy())
         # Remove _id if exists
         if "_id" in default_portfolio:
             del default_portfolio["_id"]
@@ -275,7 +673,7 @@ def get_portfolio():
     
     return portfolio
 
-@app.put("/api/portfolio")
+@router.put("/api/portfolio")
 def update_portfolio(portfolio_update: PortfolioUpdate, authorized: bool = Header(None, alias="Authorization")):
     """Update portfolio data (admin only)"""
     try:
@@ -294,7 +692,7 @@ def update_portfolio(portfolio_update: PortfolioUpdate, authorized: bool = Heade
     if not update_data:
         raise HTTPException(status_code=400, detail="No data to update")
     
-    portfolio_collection.update_one(
+    get_db().portfolio.update_one(
         {"type": "main"},
         {"$set": update_data},
         upsert=True
@@ -302,11 +700,14 @@ def update_portfolio(portfolio_update: PortfolioUpdate, authorized: bool = Heade
     
     return {"message": "Portfolio updated successfully"}
 
-@app.post("/api/portfolio/cv/upload")
+@router.post("/api/portfolio/cv/upload")
 async def upload_cv(
     language: str,
     file: UploadFile = File(...),
-    authorization: Optional[str] = Header(None)
+    background: bool = False,
+    authorization: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+    owner_id: str = Depends(get_owner)
 ):
     """Upload CV file (admin only)"""
     if not authorization or not authorization.startswith("Bearer "):
@@ -325,31 +726,64 @@ async def upload_cv(
     # Read file content
     content = await file.read()
     
+    # This handler is async, so every blocking pymongo call goes through a thread
+    scope = "upload_cv"
+    if idempotency_key:
+        fingerprint = await asyncio.to_thread(request_fingerprint, language, file.filename, content, background)
+        stored = await asyncio.to_thread(claim_idempotency_key, scope, idempotency_key, fingerprint)
+        if stored is not None:
+            # A repeated background upload gets the job it already started
+            return JSONResponse(status_code=202, content=stored) if background else stored
+    
+    try:
+        if background:
+            # Encoding and storing large files happens on the job queue; poll /api/jobs/{id}
+            body = jsonable_encoder(await job_queue.submit(
+                "upload_cv", run_upload_cv_job, owner_id,
+                params={"language": language, "filename": file.filename},
+                payload=content
+            ))
+            response = JSONResponse(status_code=202, content=body)
+        else:
+            response = body = await asyncio.to_thread(_store_cv, language, file.filename, content)
+    except Exception:
+        if idempotency_key:
+            await asyncio.to_thread(release_idempotency_key, scope, idempotency_key)
+        raise
+    
+    if idempotency_key:
+        await asyncio.to_thread(complete_idempotency_key, scope, idempotency_key, body)
+    return response
+
+def encode_cv_content(content: bytes) -> str:
+    return base64.b64encode(content).decode('utf-8')
+
+def _store_cv(language: str, filename: str, content: bytes, encoded: Optional[str] = None):
     # Store as base64 in MongoDB
     cv_data = {
         "language": language,
-        "filename": file.filename,
-        "content": base64.b64encode(content).decode('utf-8'),
+        "filename": filename,
+        "content": encoded if encoded is not None else encode_cv_content(content),
         "content_type": "application/pdf",
         "uploaded_at": datetime.utcnow()
     }
     
     # Update or insert
-    cv_files_collection.update_one(
+    get_db().cv_files.update_one(
         {"language": language},
         {"$set": cv_data},
         upsert=True
     )
     
-    return {"message": f"CV ({language}) uploaded successfully", "filename": file.filename}
+    return {"message": f"CV ({language}) uploaded successfully", "filename": filename}
 
-@app.get("/api/portfolio/cv/{language}")
+@router.get("/api/portfolio/cv/{language}")
 def download_cv(language: str):
     """Download CV file (public endpoint)"""
     if language not in ["en", "de"]:
         raise HTTPException(status_code=400, detail="Language must be 'en' or 'de'")
     
-    cv_file = cv_files_collection.find_one({"language": language})
+    cv_file = get_db().cv_files.find_one({"language": language})
     
     if not cv_file:
         raise HTTPException(status_code=404, detail=f"CV not found for language: {language}")
@@ -365,13 +799,13 @@ def download_cv(language: str):
         }
     )
 
-@app.get("/api/portfolio/cv/check/{language}")
+@router.get("/api/portfolio/cv/check/{language}")
 def check_cv_exists(language: str):
     """Check if CV exists for a language"""
     if language not in ["en", "de"]:
         raise HTTPException(status_code=400, detail="Language must be 'en' or 'de'")
     
-    cv_file = cv_files_collection.find_one({"language": language})
+    cv_file = get_db().cv_files.find_one({"language": language})
     
     return {
         "exists": cv_file is not None,
@@ -379,6 +813,407 @@ def check_cv_exists(language: str):
         "uploaded_at": cv_file.get("uploaded_at") if cv_file else None
     }
 
+# ==================== Archive Compaction ====================
+
+# Applications in a terminal state that have not been touched for this long are
+# moved out of the hot collection; tombstones are purged after the same window
+TERMINAL_STATUSES = ["Rejected"]
+TERMINAL_PROGRESS = ["Completed"]
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '180'))
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', '30'))
+COMPACTION_BATCH_SIZE = int(os.environ.get('COMPACTION_BATCH_SIZE', '500'))
+COMPACTION_INTERVAL_SECONDS = int(os.environ.get('COMPACTION_INTERVAL_SECONDS', '21600'))
+
+def ensure_indexes():
+    # Tenant-facing queries all lead with owner_id so each one only walks that
+    # owner's slice of the index. Compaction runs across tenants: archiving uses
+    # the (field, updated_at) indexes and the tombstone purge a partial index on
+    # deleted_at that only holds soft-deleted documents.
+    get_db().applications.create_index([("owner_id", 1), ("id", 1)])
+    get_db().applications.create_index([("owner_id", 1), ("deleted_at", 1), ("created_at", -1)])
+    get_db().applications.create_index([("owner_id", 1), ("deleted_at", 1), ("status", 1)])
+    get_db().applications.create_index([("status", 1), ("updated_at", 1)])
+    get_db().applications.create_index([("progress", 1), ("updated_at", 1)])
+    get_db().applications.create_index("deleted_at", partialFilterExpression={"deleted_at": {"$exists": True}})
+    get_db().applications_archive.create_index("id", unique=True)
+    get_db().applications_archive.create_index([("owner_id", 1), ("created_at", -1)])
+    get_db().idempotency_keys.create_index([("scope", 1), ("key", 1)], unique=True)
+    get_db().idempotency_keys.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_KEY_TTL_SECONDS)
+    # Polls, state updates and interrupted-job marking all look jobs up by id;
+    # the heartbeat sweep filters unfinished jobs by status and age
+    get_db().jobs.create_index("id")
+    get_db().jobs.create_index([("status", 1), ("created_at", 1)])
+    get_db().jobs.create_index("created_at", expireAfterSeconds=JOB_RETENTION_SECONDS)
+    get_db().job_instances.create_index("instance_id", unique=True)
+    get_db().job_instances.create_index("heartbeat_at", expireAfterSeconds=JOB_RETENTION_SECONDS)
+
+def assign_default_owner():
+    """Hand applications created before tenants existed to DEFAULT_OWNER"""
+    get_db().applications.update_many({"owner_id": {"$exists": False}}, {"$set": {"owner_id": DEFAULT_OWNER}})
+    get_db().applications_archive.update_many({"owner_id": {"$exists": False}}, {"$set": {"owner_id": DEFAULT_OWNER}})
+
+def compact_applications(now: Optional[datetime] = None):
+    """Archive stale terminal applications and purge expired tombstones in batches"""
+    now = now or datetime.utcnow()
+    archive_cutoff = now - timedelta(days=ARCHIVE_AFTER_DAYS)
+    tombstone_cutoff = now - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    
+    # One query per terminal field rather than an $or, so each is served by its
+    # own (field, updated_at) index and only reads the candidates it archives
+    archive_queries = [
+        {"status": {"$in": TERMINAL_STATUSES}, "updated_at": {"$lt": archive_cutoff}, "deleted_at": None},
+        {"progress": {"$in": TERMINAL_PROGRESS}, "updated_at": {"$lt": archive_cutoff}, "deleted_at": None}
+    ]
+    
+    archived = 0
+    for archive_query in archive_queries:
+        while True:
+            batch = list(get_db().applications.find(archive_query).limit(COMPACTION_BATCH_SIZE))
+            if not batch:
+                break
+            # Upsert by id so a batch interrupted between the two writes can be re-run safely
+            get_db().applications_archive.bulk_write([
+                pymongo.ReplaceOne({"id": doc["id"]}, {**{k: v for k, v in doc.items() if k != "_id"}, "archived_at": now}, upsert=True)
+                for doc in batch
+            ], ordered=False)
+            # Delete by _id: no tenant-free index leads with id on the hot collection.
+            # Repeating archive_query leaves anything edited since the find in place.
+            batch_ids = [doc["_id"] for doc in batch]
+            deleted = get_db().applications.delete_many({**archive_query, "_id": {"$in": batch_ids}}).deleted_count
+            if deleted < len(batch):
+                # Those documents changed after being read, so the archived copies are stale
+                kept = [doc["id"] for doc in get_db().applications.find({"_id": {"$in": batch_ids}}, {"_id": 0, "id": 1})]
+                get_db().applications_archive.delete_many({"id": {"$in": kept}})
+            archived += deleted
+    
+    purge_query = {"deleted_at": {"$exists": True, "$lt": tombstone_cutoff}}
+    purged = 0
+    while True:
+        batch = [doc["_id"] for doc in get_db().applications.find(purge_query, {"_id": 1}).limit(COMPACTION_BATCH_SIZE)]
+        if not batch:
+            break
+        # Repeat the filter so a tombstone restored since the find survives
+        purged += get_db().applications.delete_many({**purge_query, "_id": {"$in": batch}}).deleted_count
+    
+    return {"archived": archived, "purged": purged}
+
+async def run_compaction_loop():
+    while True:
+        await asyncio.sleep(COMPACTION_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(compact_applications)
+        except Exception:
+            # Any failure is logged and retried next interval rather than ending the loop
+            logger.exception("Application compaction failed")
+
+@router.post("/api/admin/applications/compact")
+def trigger_compaction(authorized: bool = Depends(verify_admin)):
+    """Run archive compaction immediately (admin only)"""
+    return compact_applications()
+
+@router.post("/api/admin/users/{user_id}/token")
+def issue_user_token(user_id: str, authorized: bool = Depends(verify_admin)):
+    """Issue the X-User-Token that scopes a client to its own applications (admin only)"""
+    if "." in user_id:
+        raise HTTPException(status_code=400, detail="User id must not contain '.'")
+    return {"user_id": user_id, "token": sign_user_token(user_id)}
+
+@router.get("/api/admin/profiling/queries")
+def get_slow_query_shapes(limit: int = SLOW_QUERY_TOP_N, authorized: bool = Depends(verify_admin)):
+    """Slowest query shapes by total time (admin only)"""
+    return {"enabled": PROFILE_QUERIES, "shapes": slow_queries.top(max(1, limit))}
+
+@router.delete("/api/admin/profiling/queries")
+def reset_slow_query_shapes(authorized: bool = Depends(verify_admin)):
+    """Reset the query shape table (admin only)"""
+    slow_queries.clear()
+    return {"message": "Query profile reset"}
+
+@router.get("/api/admin/profiling/requests")
+def get_profiled_requests(authorized: bool = Depends(verify_admin)):
+    """Most recent cProfile results from requests sent with the X-Profile header (admin only)"""
+    return {"requests": list(reversed(profiled_requests))}
+
+# ==================== Background Jobs ====================
+
+# Expensive work runs on an in-process queue instead of the request thread.
+# Job state lives in the jobs collection so any request can poll it; payloads
+# that are too large to persist (uploaded files) only travel through the queue.
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+# CPU-bound steps run in threads by default; "process" opts into a process pool,
+# which only pays off for pure-Python work heavier than pickling its payload
+JOB_CPU_EXECUTOR = os.environ.get('JOB_CPU_EXECUTOR', 'thread')
+JOB_PROCESS_WORKERS = int(os.environ.get('JOB_PROCESS_WORKERS', '2'))
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', '86400'))
+# Queued jobs hold their payload (e.g. a whole uploaded file) in memory, so the queue is bounded
+JOB_QUEUE_MAXSIZE = int(os.environ.get('JOB_QUEUE_MAXSIZE', '100'))
+JOB_INTERRUPTED_ERROR = "Interrupted by server restart"
+# Each running queue heartbeats into job_instances; unfinished jobs whose queue
+# has been silent longer than the timeout are marked interrupted by any live one
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', '15'))
+JOB_INSTANCE_TIMEOUT_SECONDS = int(os.environ.get('JOB_INSTANCE_TIMEOUT_SECONDS', '60'))
+
+class JobSubmission(BaseModel):
+    type: str
+    params: dict = {}
+
+class JobQueue:
+    def __init__(self):
+        self._queue = None
+        self._workers = []
+        self._process_pool = None
+        self._pending = set()
+        self._heartbeat = None
+        self.instance_id = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self, workers: int):
+        self.instance_id = str(uuid.uuid4())
+        self._queue = asyncio.Queue(maxsize=JOB_QUEUE_MAXSIZE)
+        self._pending = set()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(workers)]
+        self._heartbeat = asyncio.create_task(self._beat())
+
+    async def stop(self):
+        self._heartbeat.cancel()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(self._heartbeat, *self._workers, return_exceptions=True)
+        self._workers = []
+        # Jobs still queued or running die with this process; say so instead of
+        # leaving pollers waiting on them until the retention TTL
+        try:
+            if self._pending:
+                await asyncio.to_thread(mark_interrupted_jobs, {"id": {"$in": list(self._pending)}, "instance_id": self.instance_id})
+            await asyncio.to_thread(get_db().job_instances.delete_one, {"instance_id": self.instance_id})
+        except pymongo.errors.PyMongoError as exc:
+            logger.error("Interrupted jobs could not be marked failed: %s", exc)
+        self._pending = set()
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+    async def run_cpu_bound(self, func, *args):
+        if JOB_CPU_EXECUTOR != "process":
+            return await asyncio.to_thread(func, *args)
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(max_workers=JOB_PROCESS_WORKERS)
+        return await asyncio.get_running_loop().run_in_executor(self._process_pool, func, *args)
+
+    async def submit(self, job_type: str, handler, owner_id: str, params: dict, payload=None):
+        if not self.running:
+            raise HTTPException(status_code=503, detail="Job queue is not running")
+        if self._queue.full():
+            raise HTTPException(status_code=503, detail="Job queue is full, retry later")
+        job = {
+            "id": str(uuid.uuid4()),
+            "type": job_type,
+            "owner_id": owner_id,
+            "instance_id": self.instance_id,
+            "status": "queued",
+            "params": params,
+            "result": None,
+            "error": None,
+            "created_at": datetime.utcnow(),
+            "started_at": None,
+            "finished_at": None
+        }
+        await asyncio.to_thread(get_db().jobs.insert_one, dict(job))
+        try:
+            self._queue.put_nowait((job["id"], handler, params, payload))
+        except asyncio.QueueFull:
+            # Filled up by concurrent submissions while the job was being saved
+            await asyncio.to_thread(_set_job_state, job["id"], "queued", status="failed", error="Job queue is full", finished_at=datetime.utcnow())
+            raise HTTPException(status_code=503, detail="Job queue is full, retry later")
+        self._pending.add(job["id"])
+        return public_job(job)
+
+    async def _work(self):
+        while True:
+            job_id, handler, params, payload = await self._queue.get()
+            try:
+                started = await asyncio.to_thread(_set_job_state, job_id, "queued", status="running", started_at=datetime.utcnow())
+                if not started:
+                    logger.warning("Job %s was marked interrupted before it started; skipping it", job_id)
+                    continue
+                try:
+                    result = await handler(params, payload)
+                except Exception as exc:
+                    await asyncio.to_thread(_set_job_state, job_id, "running", status="failed", error=str(exc), finished_at=datetime.utcnow())
+                else:
+                    await asyncio.to_thread(_set_job_state, job_id, "running", status="succeeded", result=jsonable_encoder(result), finished_at=datetime.utcnow())
+            except pymongo.errors.PyMongoError as exc:
+                logger.error("Job %s state could not be saved: %s", job_id, exc)
+            finally:
+                self._queue.task_done()
+                # Skipped when cancelled mid-job, so stop() still sees it as pending
+                if not asyncio.current_task().cancelling():
+                    self._pending.discard(job_id)
+
+    async def _beat(self):
+        # The first beat is part of database setup at startup
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                await asyncio.to_thread(heartbeat_and_sweep, self.instance_id)
+            except Exception:
+                logger.exception("Job queue heartbeat failed")
+
+job_queue = JobQueue()
+
+def mark_interrupted_jobs(query: dict):
+    get_db().jobs.update_many(
+        {**query, "status": {"$in": ["queued", "running"]}},
+        {"$set": {"status": "failed", "error": JOB_INTERRUPTED_ERROR, "finished_at": datetime.utcnow()}}
+    )
+
+def heartbeat_and_sweep(instance_id: str):
+    now = datetime.utcnow()
+    get_db().job_instances.update_one(
+        {"instance_id": instance_id}, {"$set": {"heartbeat_at": now}}, upsert=True
+    )
+    cutoff = now - timedelta(seconds=JOB_INSTANCE_TIMEOUT_SECONDS)
+    live = get_db().job_instances.distinct("instance_id", {"heartbeat_at": {"$gte": cutoff}})
+    # Older than the timeout too, so a queue that has not sent its first heartbeat is left alone
+    mark_interrupted_jobs({"instance_id": {"$nin": live}, "created_at": {"$lt": cutoff}})
+
+def _set_job_state(job_id: str, expected_status: str, **fields) -> bool:
+    # Conditional on the current status so a job already marked interrupted is never revived
+    result = get_db().jobs.update_one({"id": job_id, "status": expected_status}, {"$set": fields})
+    return result.matched_count > 0
+
+def public_job(job: dict) -> dict:
+    job = {k: v for k, v in job.items() if k not in ("_id", "owner_id", "result")}
+    job["status_url"] = f"/api/jobs/{job['id']}"
+    job["result_url"] = f"/api/jobs/{job['id']}/result"
+    return job
+
+async def run_application_stats_job(params: dict, payload):
+    return await asyncio.to_thread(compute_application_stats, params["owner_id"], params.get("include_archived", False))
+
+async def run_upload_cv_job(params: dict, payload: bytes):
+    encoded = await job_queue.run_cpu_bound(encode_cv_content, payload)
+    return await asyncio.to_thread(_store_cv, params["language"], params["filename"], payload, encoded)
+
+# Job types clients may submit through POST /api/jobs
+JOB_HANDLERS = {
+    "application_stats": run_application_stats_job,
+}
+
+@router.post("/api/jobs", status_code=202)
+async def submit_job(submission: JobSubmission, owner_id: str = Depends(get_owner)):
+    handler = JOB_HANDLERS.get(submission.type)
+    if handler is None:
+        raise HTTPException(status_code=400, detail=f"Unknown job type: {submission.type}")
+    # Jobs always run as the submitting owner, whatever the params say
+    params = {**submission.params, "owner_id": owner_id}
+    return await job_queue.submit(submission.type, handler, owner_id, params)
+
+@router.get("/api/jobs/{job_id}")
+def get_job(job_id: str, owner_id: str = Depends(get_owner)):
+    job = get_db().jobs.find_one({"id": job_id, "owner_id": owner_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return public_job(job)
+
+@router.get("/api/jobs/{job_id}/result")
+def get_job_result(job_id: str, owner_id: str = Depends(get_owner)):
+    job = get_db().jobs.find_one({"id": job_id, "owner_id": owner_id}, {"_id": 0, "status": 1, "result": 1, "error": 1})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "failed":
+        # The job failed, not this request; 424 keeps it out of server-error alerting
+        raise HTTPException(status_code=424, detail=f"Job failed: {job['error']}")
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return job["result"]
+
+# ==================== Application Factory ====================
+
+DB_SETUP_RETRY_SECONDS = float(os.environ.get('DB_SETUP_RETRY_SECONDS', '10'))
+
+# Set once indexes exist; unique and TTL indexes are load-bearing, so the app
+# does not report ready before then
+database_setup_done = False
+
+def prepare_database():
+    global database_setup_done
+    ensure_indexes()
+    assign_default_owner()
+    heartbeat_and_sweep(job_queue.instance_id)
+    database_setup_done = True
+
+async def retry_database_setup():
+    while True:
+        await asyncio.sleep(DB_SETUP_RETRY_SECONDS)
+        try:
+            await asyncio.to_thread(prepare_database)
+            return
+        except pymongo.errors.PyMongoError as exc:
+            logger.warning("Database setup retry failed: %s", exc)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global database_setup_done
+    database_setup_done = False
+    job_queue.start(JOB_WORKERS)
+    setup_task = None
+    try:
+        await asyncio.to_thread(prepare_database)
+    except pymongo.errors.PyMongoError as exc:
+        # Serve anyway and keep retrying; /api/health/ready reports the outage until setup succeeds
+        logger.warning("Database setup deferred, database unavailable: %s", exc)
+        setup_task = asyncio.create_task(retry_database_setup())
+    
+    compaction_task = None
+    if COMPACTION_INTERVAL_SECONDS > 0:
+        compaction_task = asyncio.create_task(run_compaction_loop())
+    
+    yield
+    
+    await job_queue.stop()
+    if compaction_task:
+        compaction_task.cancel()
+    if setup_task:
+        setup_task.cancel()
+    close_db()
+
+@router.get("/api/health/ready")
+def readiness():
+    """Readiness probe: 200 only when the database answers a ping and indexes are set up"""
+    try:
+        get_db().command("ping")
+    except pymongo.errors.PyMongoError as exc:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "detail": str(exc)})
+    if not database_setup_done:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "detail": "Database setup pending"})
+    return {"status": "ready"}
+
+def create_app(database=None) -> FastAPI:
+    if database is not None:
+        set_database(database)
+    
+    app = FastAPI(lifespan=lifespan)
+    
+    # CORS configuration
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    
+    if PROFILE_REQUESTS:
+        app.middleware("http")(profile_request_middleware)
+    app.include_router(router)
+    return app
+
+app = create_app()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -0,0 +1,213 @@
+import base64
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pymongo
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "backend"))
+
+import server  # noqa: E402
+
+# Data layer used by the suite: "mongomock" (default, in-process) or "mongod"
+# (spawns a throwaway local mongod, or uses TEST_MONGO_URL when it is set)
+MONGO_BACKEND = os.environ.get("TEST_MONGO_BACKEND", "mongomock")
+
+COUNTED_OPERATIONS = {
+    "find", "find_one", "count_documents", "aggregate", "insert_one", "insert_many",
+    "update_one", "update_many", "replace_one", "delete_one", "delete_many",
+    "bulk_write", "find_one_and_update",
+}
+
+
+class QueryLog(list):
+    """Round trips issued by the app during a test, as (collection, operation) pairs"""
+
+    def count(self, operation=None, collection=None):
+        return sum(
+            1 for coll, op in self
+            if (operation is None or op == operation) and (collection is None or coll == collection)
+        )
+
+
+class CountingCollection:
+    """Collection proxy that records every server round trip in a QueryLog"""
+
+    def __init__(self, collection, log):
+        self._collection = collection
+        self._log = log
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in COUNTED_OPERATIONS:
+            return attr
+
+        def counted(*args, **kwargs):
+            self._log.append((self._collection.name, name))
+            return attr(*args, **kwargs)
+
+        return counted
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def mongo_client():
+    if MONGO_BACKEND == "mongomock":
+        import mongomock
+
+        yield mongomock.MongoClient()
+        return
+
+    if os.environ.get("TEST_MONGO_URL"):
+        client = pymongo.MongoClient(os.environ["TEST_MONGO_URL"])
+        yield client
+        client.close()
+        return
+
+    mongod = shutil.which("mongod")
+    if not mongod:
+        pytest.skip("TEST_MONGO_BACKEND=mongod but no mongod binary on PATH")
+    dbpath = tempfile.mkdtemp(prefix="jobapp-mongod-")
+    port = _free_port()
+    process = subprocess.Popen(
+        [mongod, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL,
+    )
+    client = pymongo.MongoClient(f"mongodb://127.0.0.1:{port}", serverSelectionTimeoutMS=500)
+    deadline = time.monotonic() + 20
+    while True:
+        try:
+            client.admin.command("ping")
+            break
+        except pymongo.errors.PyMongoError:
+            if time.monotonic() > deadline:
+                process.kill()
+                raise
+            time.sleep(0.2)
+    yield client
+    client.close()
+    process.terminate()
+    process.wait()
+    shutil.rmtree(dbpath, ignore_errors=True)
+
+
+@pytest.fixture
+def mongo_db(mongo_client):
+    name = f"jobapp_test_{uuid.uuid4().hex[:8]}"
+    yield mongo_client[name]
+    mongo_client.drop_database(name)
+
+
+@pytest.fixture
+def query_log():
+    return QueryLog()
+
+
+class CountingDatabase:
+    """Database proxy whose collections all report into the same QueryLog"""
+
+    def __init__(self, database, log):
+        self._database = database
+        self._log = log
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name], self._log)
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name in {"command", "name", "client"}:
+            return getattr(self._database, name)
+        return self[name]
+
+
+@pytest.fixture
+def client(mongo_db, query_log, monkeypatch):
+    """TestClient for a fresh app wired to the test database, with every collection round trip counted"""
+    monkeypatch.setattr(server, "COMPACTION_INTERVAL_SECONDS", 0)
+    # Keep periodic job-queue heartbeats out of the round-trip counts
+    monkeypatch.setattr(server, "JOB_HEARTBEAT_SECONDS", 3600)
+
+    with TestClient(server.create_app(database=CountingDatabase(mongo_db, query_log))) as test_client:
+        query_log.clear()
+        yield test_client
+
+    server.set_database(None)
+
+
+@pytest.fixture
+def auth_headers():
+    return {"Authorization": f"Bearer {server.ADMIN_PASSWORD}"}
+
+
+@pytest.fixture
+def make_applications(mongo_db):
+    """Insert `count` application documents directly, bypassing the API"""
+    statuses = ["Applied", "Interviewing", "Offer", "Rejected"]
+    progresses = ["Not Started", "In Progress", "Completed"]
+
+    def factory(count, **overrides):
+        now = datetime.utcnow()
+        docs = []
+        for i in range(count):
+            created = now - timedelta(minutes=i)
+            doc = {
+                "id": str(uuid.uuid4()),
+                "owner_id": server.DEFAULT_OWNER,
+                "job_title": f"Engineer {i}",
+                "company_name": f"Company {i % 50}",
+                "recruiter_name": f"Recruiter {i % 7}",
+                "application_date": (created.date()).isoformat(),
+                "status": statuses[i % len(statuses)],
+                "progress": progresses[i % len(progresses)],
+                "notes": "",
+                "created_at": created,
+                "updated_at": created,
+            }
+            doc.update(overrides)
+            docs.append(doc)
+        if docs:
+            mongo_db.applications.insert_many([dict(doc) for doc in docs])
+        return docs
+
+    return factory
+
+
+@pytest.fixture
+def make_cv(mongo_db):
+    """Store a CV document of `size` bytes for `language` directly, bypassing the API"""
+    def factory(language="en", size=256 * 1024):
+        content = os.urandom(size)
+        mongo_db.cv_files.insert_one({
+            "language": language,
+            "filename": f"cv_{language}.pdf",
+            "content": base64.b64encode(content).decode("utf-8"),
+            "content_type": "application/pdf",
+            "uploaded_at": datetime.utcnow(),
+        })
+        return content
+
+    return factory
+
+
+try:
+    import pytest_benchmark  # noqa: F401
+except ImportError:
+    @pytest.fixture
+    def benchmark():
+        """Single-shot stand-in so the suite still runs without pytest-benchmark"""
+        def run(func, *args, **kwargs):
+            return func(*args, **kwargs)
+
+        return run
@@ -0,0 +1,239 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+
+def new_application(**overrides):
+    data = {
+        "job_title": "Cloud Engineer",
+        "company_name": "Acme",
+        "recruiter_name": "Jane",
+        "application_date": "2024-05-01",
+        "status": "Applied",
+        "progress": "In Progress",
+        "notes": "",
+    }
+    data.update(overrides)
+    return data
+
+
+def test_delete_leaves_tombstone_and_restore_brings_it_back(client, mongo_db):
+    app_id = client.post("/api/applications", json=new_application()).json()["id"]
+
+    assert client.delete(f"/api/applications/{app_id}").status_code == 200
+    assert mongo_db.applications.find_one({"id": app_id})["deleted_at"] is not None
+    assert client.get(f"/api/applications/{app_id}").status_code == 404
+    assert client.get("/api/applications").json()["total"] == 0
+    assert client.delete(f"/api/applications/{app_id}").status_code == 404
+
+    response = client.post(f"/api/applications/{app_id}/restore")
+    assert response.status_code == 200
+    assert client.get("/api/applications").json()["total"] == 1
+    assert client.post(f"/api/applications/{app_id}/restore").status_code == 404
+
+
+def test_compaction_archives_terminal_applications(client, mongo_db, make_applications):
+    old = datetime.utcnow() - timedelta(days=server.ARCHIVE_AFTER_DAYS + 1)
+    stale = make_applications(3, status="Rejected", progress="Not Started", updated_at=old, created_at=old)
+    make_applications(2, status="Applied", progress="In Progress")
+
+    assert server.compact_applications() == {"archived": 3, "purged": 0}
+    assert mongo_db.applications.count_documents({}) == 2
+    assert mongo_db.applications_archive.count_documents({}) == 3
+
+    assert client.get("/api/applications").json()["total"] == 2
+    listing = client.get("/api/applications", params={"include_archived": True}).json()
+    assert listing["total"] == 5
+    assert len(listing["applications"]) == 5
+    stats = client.get("/api/applications/stats/summary", params={"include_archived": True}).json()
+    assert stats["by_status"]["Rejected"] == 3
+
+    archived_id = stale[0]["id"]
+    assert client.get(f"/api/applications/{archived_id}").status_code == 404
+    assert client.get(f"/api/applications/{archived_id}", params={"include_archived": True}).status_code == 200
+    assert client.post(f"/api/applications/{archived_id}/restore").status_code == 200
+    assert mongo_db.applications_archive.count_documents({}) == 2
+
+
+def test_compaction_purges_expired_tombstones(client, mongo_db, make_applications):
+    expired = datetime.utcnow() - timedelta(days=server.TOMBSTONE_RETENTION_DAYS + 1)
+    make_applications(2, deleted_at=expired)
+    make_applications(1, deleted_at=datetime.utcnow())
+
+    assert server.compact_applications() == {"archived": 0, "purged": 2}
+    assert mongo_db.applications.count_documents({}) == 1
+
+
+def test_compaction_endpoint_requires_admin(client, auth_headers):
+    assert client.post("/api/admin/applications/compact").status_code == 401
+    response = client.post("/api/admin/applications/compact", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json() == {"archived": 0, "purged": 0}
+
+
+def test_applications_are_scoped_to_their_owner(client, auth_headers, make_applications):
+    alice = {"X-User-Token": client.post("/api/admin/users/alice/token", headers=auth_headers).json()["token"]}
+    bob = {"X-User-Token": client.post("/api/admin/users/bob/token", headers=auth_headers).json()["token"]}
+    make_applications(3)
+    app_id = client.post("/api/applications", json=new_application(status="Offer"), headers=alice).json()["id"]
+
+    assert client.get("/api/applications", headers=alice).json()["total"] == 1
+    assert client.get("/api/applications", headers=bob).json()["total"] == 0
+    assert client.get("/api/applications").json()["total"] == 3
+    assert "owner_id" not in client.get("/api/applications", headers=alice).json()["applications"][0]
+    assert client.get("/api/applications/stats/summary", headers=alice).json() == {"total": 1, "by_status": {"Offer": 1}}
+
+    assert client.get(f"/api/applications/{app_id}", headers=bob).status_code == 404
+    assert client.put(f"/api/applications/{app_id}", json={"notes": "x"}, headers=bob).status_code == 404
+    assert client.delete(f"/api/applications/{app_id}", headers=bob).status_code == 404
+    assert client.delete(f"/api/applications/{app_id}", headers=alice).status_code == 200
+    assert client.post(f"/api/applications/{app_id}/restore", headers=bob).status_code == 404
+
+
+def test_forged_user_token_is_rejected(client):
+    response = client.get("/api/applications", headers={"X-User-Token": "alice.not-a-signature"})
+    assert response.status_code == 401
+
+
+def test_legacy_applications_are_assigned_to_default_owner(mongo_db, client):
+    mongo_db.applications.insert_one({**new_application(), "id": "legacy", "created_at": datetime.utcnow(), "updated_at": datetime.utcnow()})
+
+    server.assign_default_owner()
+
+    assert mongo_db.applications.find_one({"id": "legacy"})["owner_id"] == server.DEFAULT_OWNER
+    assert client.get("/api/applications/legacy").status_code == 200
+
+
+def test_create_with_idempotency_key_is_written_once(client, mongo_db):
+    headers = {"Idempotency-Key": "retry-1"}
+    first = client.post("/api/applications", json=new_application(), headers=headers)
+    second = client.post("/api/applications", json=new_application(), headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert mongo_db.applications.count_documents({}) == 1
+
+    reused = client.post("/api/applications", json=new_application(job_title="Other"), headers=headers)
+    assert reused.status_code == 422
+
+    client.post("/api/applications", json=new_application(), headers={"Idempotency-Key": "retry-2"})
+    assert mongo_db.applications.count_documents({}) == 2
+
+
+def test_idempotency_keys_are_scoped_per_owner(client, auth_headers, mongo_db):
+    alice = {"X-User-Token": client.post("/api/admin/users/alice/token", headers=auth_headers).json()["token"]}
+    client.post("/api/applications", json=new_application(), headers={"Idempotency-Key": "k"})
+    client.post("/api/applications", json=new_application(), headers={**alice, "Idempotency-Key": "k"})
+
+    assert mongo_db.applications.count_documents({}) == 2
+
+
+def test_upload_cv_with_idempotency_key_is_written_once(client, auth_headers, query_log):
+    headers = {**auth_headers, "Idempotency-Key": "cv-1"}
+    files = {"file": ("cv.pdf", b"%PDF-1.4 test", "application/pdf")}
+
+    first = client.post("/api/portfolio/cv/upload", params={"language": "en"}, files=files, headers=headers)
+    second = client.post("/api/portfolio/cv/upload", params={"language": "en"}, files=files, headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert query_log.count("update_one", collection="cv_files") == 1
+
+
+def test_compaction_archives_each_terminal_field_once(client, mongo_db, make_applications):
+    old = datetime.utcnow() - timedelta(days=server.ARCHIVE_AFTER_DAYS + 1)
+    make_applications(2, status="Rejected", progress="Completed", updated_at=old)
+    make_applications(2, status="Applied", progress="Completed", updated_at=old)
+    make_applications(1, status="Rejected", progress="In Progress", updated_at=old)
+
+    assert server.compact_applications() == {"archived": 5, "purged": 0}
+    assert mongo_db.applications.count_documents({}) == 0
+
+
+def test_restore_from_archive_is_scoped_to_owner(client, auth_headers, mongo_db, make_applications):
+    alice = {"X-User-Token": client.post("/api/admin/users/alice/token", headers=auth_headers).json()["token"]}
+    old = datetime.utcnow() - timedelta(days=server.ARCHIVE_AFTER_DAYS + 1)
+    [archived] = make_applications(1, owner_id="alice", status="Rejected", updated_at=old)
+    server.compact_applications()
+
+    assert client.post(f"/api/applications/{archived['id']}/restore").status_code == 404
+    assert mongo_db.applications_archive.count_documents({"id": archived["id"]}) == 1
+    assert client.post(f"/api/applications/{archived['id']}/restore", headers=alice).status_code == 200
+    assert mongo_db.applications.find_one({"id": archived["id"]})["owner_id"] == "alice"
+
+
+def test_stale_idempotency_claim_is_taken_over(client, mongo_db):
+    scope = f"create_application:{server.DEFAULT_OWNER}"
+    claimed_at = datetime.utcnow()
+    mongo_db.idempotency_keys.insert_one({
+        "scope": scope, "key": "stuck", "fingerprint": server.request_fingerprint(server.JobApplication(**new_application())),
+        "response": None, "created_at": claimed_at, "claimed_at": claimed_at,
+    })
+
+    headers = {"Idempotency-Key": "stuck"}
+    assert client.post("/api/applications", json=new_application(), headers=headers).status_code == 409
+
+    expired = claimed_at - timedelta(seconds=server.IDEMPOTENCY_CLAIM_LEASE_SECONDS + 1)
+    mongo_db.idempotency_keys.update_one({"key": "stuck"}, {"$set": {"claimed_at": expired}})
+    first = client.post("/api/applications", json=new_application(), headers=headers)
+    assert first.status_code == 200
+    assert client.post("/api/applications", json=new_application(), headers=headers).json() == first.json()
+    assert mongo_db.applications.count_documents({}) == 1
+
+
+def test_compaction_keeps_applications_edited_mid_batch(client, mongo_db, make_applications, monkeypatch):
+    old = datetime.utcnow() - timedelta(days=server.ARCHIVE_AFTER_DAYS + 1)
+    stale, edited = make_applications(2, status="Rejected", progress="Not Started", updated_at=old)
+    bulk_write = mongo_db.applications_archive.bulk_write
+
+    def edit_during_archive(*args, **kwargs):
+        # A user touches one application after compaction read it
+        mongo_db.applications.update_one({"id": edited["id"]}, {"$set": {"notes": "new", "updated_at": datetime.utcnow()}})
+        return bulk_write(*args, **kwargs)
+
+    monkeypatch.setattr(mongo_db.applications_archive, "bulk_write", edit_during_archive)
+
+    assert server.compact_applications() == {"archived": 1, "purged": 0}
+    assert mongo_db.applications.find_one({"id": edited["id"]})["notes"] == "new"
+    assert mongo_db.applications_archive.find_one({"id": edited["id"]}) is None
+    assert mongo_db.applications_archive.find_one({"id": stale["id"]}) is not None
+
+
+def test_compaction_loop_survives_unexpected_errors(monkeypatch):
+    calls = []
+
+    def flaky_compaction():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError("unexpected")
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(server, "COMPACTION_INTERVAL_SECONDS", 0)
+    monkeypatch.setattr(server, "compact_applications", flaky_compaction)
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(server.run_compaction_loop())
+    assert len(calls) == 2
+
+
+def test_claim_released_by_a_concurrent_request_is_claimed_again(client, mongo_db, monkeypatch):
+    insert_one = mongo_db.idempotency_keys.insert_one
+    raced = []
+
+    def lose_race_to_released_claim(doc, *args, **kwargs):
+        if not raced:
+            # Another request claims the key, fails and releases it before we re-read
+            raced.append(1)
+            insert_one(dict(doc))
+            mongo_db.idempotency_keys.delete_one({"key": doc["key"]})
+            raise server.pymongo.errors.DuplicateKeyError("duplicate key")
+        return insert_one(doc, *args, **kwargs)
+
+    monkeypatch.setattr(mongo_db.idempotency_keys, "insert_one", lose_race_to_released_claim)
+
+    response = client.post("/api/applications", json=new_application(), headers={"Idempotency-Key": "raced"})
+    assert response.status_code == 200
+    assert mongo_db.applications.count_documents({}) == 1
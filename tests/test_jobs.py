@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+def wait_for_job(client, job, headers=None, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        state = client.get(job["status_url"], headers=headers).json()
+        if state["status"] in ("succeeded", "failed") or time.monotonic() > deadline:
+            return state
+        time.sleep(0.02)
+
+
+def test_stats_job_matches_inline_endpoint(client, make_applications):
+    make_applications(40)
+
+    response = client.post("/api/jobs", json={"type": "application_stats"})
+    assert response.status_code == 202
+    job = response.json()
+    assert job["status"] == "queued"
+
+    assert wait_for_job(client, job)["status"] == "succeeded"
+    result = client.get(job["result_url"])
+    assert result.status_code == 200
+    assert result.json() == client.get("/api/applications/stats/summary").json()
+
+
+def test_jobs_are_scoped_to_their_owner(client, auth_headers):
+    alice = {"X-User-Token": client.post("/api/admin/users/alice/token", headers=auth_headers).json()["token"]}
+    job = client.post("/api/jobs", json={"type": "application_stats", "params": {"owner_id": "default"}}, headers=alice).json()
+
+    assert wait_for_job(client, job, headers=alice)["status"] == "succeeded"
+    assert client.get(job["status_url"]).status_code == 404
+    assert client.get(job["result_url"], headers=alice).json() == {"total": 0, "by_status": {}}
+
+
+def test_unknown_job_type_is_rejected(client):
+    assert client.post("/api/jobs", json={"type": "upload_cv"}).status_code == 400
+    assert client.get("/api/jobs/missing").status_code == 404
+
+
+def test_failed_job_reports_error(client, monkeypatch):
+    async def explode(params, payload):
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(server.JOB_HANDLERS, "application_stats", explode)
+    job = client.post("/api/jobs", json={"type": "application_stats"}).json()
+
+    state = wait_for_job(client, job)
+    assert state["status"] == "failed"
+    assert state["error"] == "boom"
+    assert client.get(job["result_url"]).status_code == 424
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_background_cv_upload(client, auth_headers, monkeypatch, executor):
+    monkeypatch.setattr(server, "JOB_CPU_EXECUTOR", executor)
+    content = b"%PDF-1.4 " + b"x" * 64 * 1024
+    files = {"file": ("cv.pdf", content, "application/pdf")}
+
+    response = client.post(
+        "/api/portfolio/cv/upload", params={"language": "de", "background": True}, files=files, headers=auth_headers
+    )
+    assert response.status_code == 202
+
+    assert wait_for_job(client, response.json())["status"] == "succeeded"
+    assert client.get("/api/portfolio/cv/de").content == content
+
+
+def test_background_cv_upload_honors_idempotency_key(client, auth_headers, mongo_db):
+    headers = {**auth_headers, "Idempotency-Key": "bg-1"}
+    files = {"file": ("cv.pdf", b"%PDF-1.4 retry", "application/pdf")}
+    params = {"language": "en", "background": True}
+
+    first = client.post("/api/portfolio/cv/upload", params=params, files=files, headers=headers)
+    second = client.post("/api/portfolio/cv/upload", params=params, files=files, headers=headers)
+
+    assert first.status_code == second.status_code == 202
+    assert first.json()["id"] == second.json()["id"]
+    assert mongo_db.jobs.count_documents({}) == 1
+    assert wait_for_job(client, first.json())["status"] == "succeeded"
+
+
+def test_unfinished_jobs_from_a_silent_instance_are_marked_interrupted(mongo_db, monkeypatch):
+    monkeypatch.setattr(server, "COMPACTION_INTERVAL_SECONDS", 0)
+    created = datetime.utcnow() - timedelta(seconds=server.JOB_INSTANCE_TIMEOUT_SECONDS + 60)
+    mongo_db.job_instances.insert_one({"instance_id": "live", "heartbeat_at": datetime.utcnow()})
+    mongo_db.job_instances.insert_one({"instance_id": "gone", "heartbeat_at": created})
+    for job_id, status, instance_id in [
+        ("queued", "queued", "gone"), ("running", "running", None), ("done", "succeeded", "gone"), ("other", "running", "live"),
+    ]:
+        mongo_db.jobs.insert_one({
+            "id": job_id, "owner_id": server.DEFAULT_OWNER, "status": status, "instance_id": instance_id, "created_at": created,
+        })
+    mongo_db.jobs.update_one({"id": "running"}, {"$unset": {"instance_id": ""}})
+
+    try:
+        with TestClient(server.create_app(database=mongo_db)) as client:
+            deadline = time.monotonic() + 5
+            while client.get("/api/jobs/queued").json()["status"] != "failed" and time.monotonic() < deadline:
+                time.sleep(0.02)
+            assert client.get("/api/jobs/queued").json()["status"] == "failed"
+            assert client.get("/api/jobs/running").json()["error"] == server.JOB_INTERRUPTED_ERROR
+            assert client.get("/api/jobs/done").json()["status"] == "succeeded"
+            # Another instance is still heartbeating, so its job is left alone
+            assert client.get("/api/jobs/other").json()["status"] == "running"
+    finally:
+        server.set_database(None)
+
+
+def test_job_state_updates_do_not_revive_interrupted_jobs(client, mongo_db):
+    mongo_db.jobs.insert_one({"id": "swept", "owner_id": server.DEFAULT_OWNER, "status": "failed", "error": server.JOB_INTERRUPTED_ERROR})
+
+    assert server._set_job_state("swept", "running", status="succeeded", result={}) is False
+    assert mongo_db.jobs.find_one({"id": "swept"})["status"] == "failed"
+
+
+def test_pending_jobs_are_marked_interrupted_on_shutdown(mongo_db, monkeypatch):
+    monkeypatch.setattr(server, "COMPACTION_INTERVAL_SECONDS", 0)
+    started = threading.Event()
+
+    async def never_finishes(params, payload):
+        started.set()
+        await asyncio.sleep(3600)
+
+    monkeypatch.setitem(server.JOB_HANDLERS, "application_stats", never_finishes)
+    try:
+        with TestClient(server.create_app(database=mongo_db)) as client:
+            job = client.post("/api/jobs", json={"type": "application_stats"}).json()
+            assert started.wait(5)
+    finally:
+        server.set_database(None)
+
+    assert mongo_db.jobs.find_one({"id": job["id"]})["status"] == "failed"
+
+
+def test_full_queue_rejects_submissions(client, monkeypatch):
+    monkeypatch.setattr(server.job_queue._queue, "full", lambda: True)
+
+    response = client.post("/api/jobs", json={"type": "application_stats"})
+    assert response.status_code == 503
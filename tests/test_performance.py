@@ -0,0 +1,101 @@
+"""Latency benchmarks and round-trip budgets for the hot endpoints.
+
+Each test first issues one request and asserts exactly how many collection
+operations it cost, so an N+1 or an extra round trip fails loudly, then hands
+the same call to `benchmark` for timing.
+"""
+
+DATASET_SIZE = 1000
+
+
+def test_get_applications_round_trips(client, query_log, make_applications, benchmark):
+    make_applications(DATASET_SIZE)
+
+    response = client.get("/api/applications", params={"limit": 50})
+    assert response.status_code == 200
+    assert response.json()["total"] == DATASET_SIZE
+    assert len(response.json()["applications"]) == 50
+    assert query_log.count("count_documents") == 1
+    assert query_log.count("find") == 1
+    assert len(query_log) == 2
+
+    benchmark(client.get, "/api/applications", params={"limit": 50})
+
+
+def test_get_applications_filtered_search_round_trips(client, query_log, make_applications, benchmark):
+    make_applications(DATASET_SIZE)
+    params = {"status": "Applied", "progress": "In Progress", "search": "company 1", "page": 2, "limit": 10}
+
+    response = client.get("/api/applications", params=params)
+    assert response.status_code == 200
+    assert len(query_log) == 2
+
+    benchmark(client.get, "/api/applications", params=params)
+
+
+def test_get_applications_with_archive_round_trips(client, query_log, make_applications, benchmark):
+    make_applications(DATASET_SIZE)
+
+    response = client.get("/api/applications", params={"include_archived": True, "limit": 50})
+    assert response.status_code == 200
+    assert query_log.count("count_documents") == 2
+    assert query_log.count("find") == 2
+    assert len(query_log) == 4
+
+    benchmark(client.get, "/api/applications", params={"include_archived": True, "limit": 50})
+
+
+def test_get_application_stats_round_trips(client, query_log, make_applications, benchmark):
+    make_applications(DATASET_SIZE)
+
+    response = client.get("/api/applications/stats/summary")
+    assert response.status_code == 200
+    assert response.json()["total"] == DATASET_SIZE
+    assert query_log.count("aggregate") == 1
+    assert len(query_log) == 1
+
+    benchmark(client.get, "/api/applications/stats/summary")
+
+
+def test_update_application_round_trips(client, query_log, make_applications, benchmark):
+    app_id = make_applications(DATASET_SIZE)[0]["id"]
+
+    response = client.put(f"/api/applications/{app_id}", json={"status": "Interviewing"})
+    assert response.status_code == 200
+    assert response.json()["status"] == "Interviewing"
+    assert query_log.count("update_one") == 1
+    assert len(query_log) == 3
+
+    benchmark(client.put, f"/api/applications/{app_id}", json={"notes": "followed up"})
+
+
+def test_create_application_retry_round_trips(client, query_log, benchmark):
+    payload = {
+        "job_title": "Engineer",
+        "company_name": "Acme",
+        "application_date": "2024-05-01",
+        "status": "Applied",
+        "progress": "In Progress",
+    }
+    headers = {"Idempotency-Key": "retry-benchmark"}
+    assert client.post("/api/applications", json=payload, headers=headers).status_code == 200
+    query_log.clear()
+
+    # A retried create is a single read of the stored response, not another insert
+    response = client.post("/api/applications", json=payload, headers=headers)
+    assert response.status_code == 200
+    assert query_log == [("idempotency_keys", "find_one")]
+
+    benchmark(client.post, "/api/applications", json=payload, headers=headers)
+
+
+def test_download_cv_round_trips(client, query_log, make_cv, benchmark):
+    content = make_cv("en", size=512 * 1024)
+
+    response = client.get("/api/portfolio/cv/en")
+    assert response.status_code == 200
+    assert response.content == content
+    assert query_log.count("find_one") == 1
+    assert len(query_log) == 1
+
+    benchmark(client.get, "/api/portfolio/cv/en")
@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+@pytest.fixture(autouse=True)
+def empty_profiles():
+    server.slow_queries.clear()
+    server.profiled_requests.clear()
+    yield
+    server.slow_queries.clear()
+    server.profiled_requests.clear()
+
+
+def command_events(command_name, command, duration_micros, request_id=1):
+    started = SimpleNamespace(command_name=command_name, command=command, connection_id=("db", 27017), request_id=request_id)
+    succeeded = SimpleNamespace(command_name=command_name, connection_id=("db", 27017), request_id=request_id, duration_micros=duration_micros)
+    return started, succeeded
+
+
+def test_query_shape_drops_literal_values():
+    first = {"status": "Applied", "$or": [{"job_title": {"$regex": "dev", "$options": "i"}}], "deleted_at": None}
+    second = {"deleted_at": None, "status": "Rejected", "$or": [{"job_title": {"$regex": "ops", "$options": "i"}}]}
+
+    assert server.query_shape(first) == server.query_shape(second)
+    assert server.query_shape({"id": {"$in": ["a", "b"]}}) == {"id": {"$in": 1}}
+    assert server.query_shape({"status": "Applied"}) != server.query_shape({"progress": "Completed"})
+
+
+def test_listener_groups_commands_by_shape():
+    listener = server.SlowQueryListener()
+    for request_id, (status, micros) in enumerate([("Applied", 4000), ("Offer", 6000)]):
+        started, succeeded = command_events(
+            "find", {"find": "applications", "filter": {"status": status}, "sort": {"created_at": -1}}, micros, request_id
+        )
+        listener.started(started)
+        listener.succeeded(succeeded)
+    started, succeeded = command_events("explain", {"explain": {}}, 9000, request_id=99)
+    listener.started(started)
+    listener.succeeded(succeeded)
+
+    [entry] = server.slow_queries.top(10)
+    assert entry["collection"] == "applications"
+    assert entry["operation"] == "find"
+    assert entry["shape"] == {"filter": {"status": 1}, "sort": {"created_at": 1}}
+    assert entry["count"] == 2
+    assert entry["max_ms"] == 6.0
+    assert entry["avg_ms"] == 5.0
+
+
+def test_slow_query_log_is_bounded():
+    log = server.SlowQueryLog(max_shapes=3)
+    for i, elapsed in enumerate([5.0, 1.0, 9.0, 7.0]):
+        log.record("applications", "find", {f"field_{i}": 1}, elapsed)
+
+    shapes = [entry["shape"] for entry in log.top(10)]
+    assert len(shapes) == 3
+    assert {"field_1": 1} not in shapes
+
+
+def test_slow_query_log_evicts_by_total_time():
+    log = server.SlowQueryLog(max_shapes=2)
+    for _ in range(10):
+        log.record("applications", "find", {"frequent": 1}, 1.0)
+    log.record("applications", "find", {"one_off": 1}, 3.0)
+    log.record("applications", "find", {"newcomer": 1}, 2.0)
+
+    shapes = [entry["shape"] for entry in log.top(10)]
+    assert {"frequent": 1} in shapes
+    assert {"one_off": 1} not in shapes
+
+
+def test_profiling_endpoints_require_admin(client, auth_headers):
+    assert client.get("/api/admin/profiling/queries").status_code == 401
+    assert client.get("/api/admin/profiling/requests").status_code == 401
+
+    server.slow_queries.record("applications", "find", {"filter": {"status": 1}}, 12.5)
+    response = client.get("/api/admin/profiling/queries", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["shapes"][0]["total_ms"] == 12.5
+
+    assert client.delete("/api/admin/profiling/queries", headers=auth_headers).status_code == 200
+    assert client.get("/api/admin/profiling/queries", headers=auth_headers).json()["shapes"] == []
+
+
+def test_profile_header_is_ignored_unless_enabled(client, auth_headers):
+    response = client.get("/api/applications", headers={**auth_headers, "X-Profile": "1"})
+    assert "X-Profile-Id" not in response.headers
+    assert list(server.profiled_requests) == []
+
+
+def test_profile_header_captures_endpoint_profile(mongo_db, auth_headers, make_applications, monkeypatch):
+    monkeypatch.setattr(server, "PROFILE_REQUESTS", True)
+    monkeypatch.setattr(server, "COMPACTION_INTERVAL_SECONDS", 0)
+    make_applications(20)
+
+    try:
+        with TestClient(server.create_app(database=mongo_db)) as client:
+            plain = client.get("/api/applications", headers={"X-Profile": "1"})
+            assert "X-Profile-Id" not in plain.headers
+
+            response = client.get("/api/applications", headers={**auth_headers, "X-Profile": "1"})
+            assert response.status_code == 200
+            [profile] = client.get("/api/admin/profiling/requests", headers=auth_headers).json()["requests"]
+            assert profile["id"] == response.headers["X-Profile-Id"]
+            assert profile["path"] == "/api/applications"
+            assert "get_applications" in profile["stats"]
+
+            # Only one request is profiled at a time
+            with server._profile_slot:
+                busy = client.get("/api/applications", headers={**auth_headers, "X-Profile": "1"})
+            assert busy.headers["X-Profile-Skipped"] == "busy"
+            assert "X-Profile-Id" not in busy.headers
+    finally:
+        server.set_database(None)
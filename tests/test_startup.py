@@ -0,0 +1,91 @@
+import os
+import subprocess
+import sys
+import time
+
+import pymongo
+from fastapi.testclient import TestClient
+
+import server
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "backend")
+
+# Cumulative `python -X importtime` budget for `import server`; override on slow CI hosts
+IMPORT_TIME_BUDGET_MS = int(os.environ.get("IMPORT_TIME_BUDGET_MS", "1500"))
+
+HEAVY_MODULES = ["pandas", "numpy", "boto3", "uvicorn"]
+
+
+def import_server_with_importtime():
+    probe = (
+        "import sys, server; "
+        f"print(server._client is None, [m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+    )
+    env = dict(os.environ, MONGO_URL="mongodb://unreachable.invalid:27017")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and line.split("|")[-1].strip() == "server":
+            cumulative_us = int(line.split("|")[1])
+    return result.stdout.strip(), cumulative_us
+
+
+def test_import_is_cheap_and_offline():
+    stdout, cumulative_us = import_server_with_importtime()
+
+    # No Mongo client is built at import time and heavy optional modules stay unloaded
+    assert stdout == "True []"
+    assert cumulative_us is not None
+    assert cumulative_us / 1000 < IMPORT_TIME_BUDGET_MS
+
+
+def test_readiness_reports_database_state(client):
+    assert client.get("/").status_code == 200
+    response = client.get("/api/health/ready")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready"}
+
+
+def test_app_starts_and_reports_unready_without_database(monkeypatch):
+    monkeypatch.setattr(server, "COMPACTION_INTERVAL_SECONDS", 0)
+    unreachable = pymongo.MongoClient("mongodb://127.0.0.1:1", serverSelectionTimeoutMS=100)
+
+    try:
+        with TestClient(server.create_app(database=unreachable.jobapp_test)) as test_client:
+            assert test_client.get("/").status_code == 200
+            response = test_client.get("/api/health/ready")
+            assert response.status_code == 503
+            assert response.json()["status"] == "unavailable"
+    finally:
+        server.set_database(None)
+        unreachable.close()
+
+
+def test_database_setup_is_retried_until_it_succeeds(mongo_db, monkeypatch):
+    monkeypatch.setattr(server, "COMPACTION_INTERVAL_SECONDS", 0)
+    monkeypatch.setattr(server, "DB_SETUP_RETRY_SECONDS", 0.2)
+    attempts = []
+    prepare_database = server.prepare_database
+
+    def flaky_prepare_database():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise pymongo.errors.ServerSelectionTimeoutError("down")
+        prepare_database()
+
+    monkeypatch.setattr(server, "prepare_database", flaky_prepare_database)
+
+    try:
+        with TestClient(server.create_app(database=mongo_db)) as test_client:
+            assert test_client.get("/api/health/ready").status_code == 503
+            deadline = time.monotonic() + 5
+            while not server.database_setup_done and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert len(attempts) == 3
+            assert test_client.get("/api/health/ready").status_code == 200
+            assert "scope_1_key_1" in mongo_db.idempotency_keys.index_information()
+    finally:
+        server.set_database(None)